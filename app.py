@@ -1,580 +1,721 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-
-# Torre de Controle - CS Interno (Streamlit)
-# - Filial vem de custom_attributes["Lugar"] do contato
-# - Mapeia Filial -> código -> Regional
-# - Congela a tabela durante atualização (duplo buffer)
-# - Atualiza automaticamente a cada 10 minutos (sem derrubar a tabela)
-# - Horário exibido com ajuste de -3 horas (somente na UI)
-
-import json, math, time, unicodedata
-from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Optional
-
-import pandas as pd
-import requests
-import streamlit as st
-from streamlit_autorefresh import st_autorefresh
-
-from map import TEAM_MAP_RAW, filiais, regionais_base
-
-TIMEOUT = (5, 60)
-PER_PAGE = 150
-REFRESH_SECS = 600  # 10 minutos
-EXCLUDE_ADMINS = {"Suporte Mottu", "Não atribuído"}
-
-regionais_ui = dict(regionais_base)
-regionais_ui["Luciano"] = sorted(sum(regionais_base.values(), []))
-
-# mapa inverso código -> regional
-code_to_regional: Dict[int, str] = {c: reg for reg, codes in regionais_base.items() for c in codes}
-
-# -------------------------------------------------------------------
-# Normalização e mapeamento de Time
-def _normalize(s: str) -> str:
-    if s is None:
-        return ""
-    s = str(s).strip()
-    s = unicodedata.normalize("NFKD", s)
-    s = "".join(ch for ch in s if not unicodedata.combining(ch))
-    return s.casefold()
-
-TEAM_MAP = {_normalize(k): v for k, v in TEAM_MAP_RAW.items() if str(k).strip()}
-
-def map_to_team_or_self(responsavel: str) -> str:
-    norm = _normalize(responsavel)
-    if norm in TEAM_MAP and str(TEAM_MAP[norm]).strip():
-        return str(TEAM_MAP[norm]).strip()
-    return responsavel or "Não atribuído"
-
-# -------------------------
-# Helpers para Assunto / TMA / Descrição
-def extract_assunto_from_tags(tags_block: Optional[dict]) -> str:
-    """
-    Escolhe a tag que tem pelo menos 3 hifens '-' e pega o texto entre o 2º e o 3º hífen.
-    Ex.: 'CSINTERNO - ONBOARDING - ERRO AO ESCOLHER PLANO - HUMANO'
-         -> 'ERRO AO ESCOLHER PLANO'
-    """
-    if not tags_block:
-        return ""
-    tags_list = tags_block.get("tags") or []
-    main_name = ""
-    for t in tags_list:
-        name = (t.get("name") or "").strip()
-        if name.count("-") >= 3:
-            main_name = name
-            break
-    if not main_name:
-        return ""
-    parts = main_name.split("-")
-    if len(parts) >= 4:
-        return parts[2].strip()
-    # fallback se vier fora do padrão
-    return main_name
-
-def extract_descricao(conv_custom_attrs: Optional[dict]) -> str:
-    if not conv_custom_attrs:
-        return ""
-    return conv_custom_attrs.get("CS Interno - Descrição") or ""
-
-# -------------------------
-# Autenticação
-def get_auth():
-    if not getattr(st, "secrets", None) or "auth" not in st.secrets:
-        raise RuntimeError("Segredos não encontrados. No Streamlit, crie .streamlit/secrets.toml com [auth].")
-    auth = st.secrets["auth"]
-    if not (auth.get("INTERCOM_BEARER")):
-        raise RuntimeError("Chave ausente em [auth]: INTERCOM_BEARER")
-    return auth
-
-def _headers(auth: dict) -> dict:
-    return {
-        "Authorization": f"Bearer {(auth.get('INTERCOM_BEARER') or '').strip()}",
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Intercom-Version": auth.get("INTERCOM_VERSION", "2.14"),
-        "Accept-Encoding": "gzip, deflate",
-        "Connection": "keep-alive",
-    }
-
-# -------------------------
-# Fetch Intercom
-def fetch_admin_map(base_url: str, hdrs: dict) -> Dict[str, str]:
-    url = f"{base_url}/admins"
-    r = requests.get(url, headers=hdrs, timeout=TIMEOUT)
-    r.raise_for_status()
-    admins = (r.json() or {}).get("admins", [])
-    return {str(a.get("id")): a.get("name") for a in admins if a.get("id") is not None}
-
-def fetch_conversations(base_url: str, hdrs: dict) -> List[dict]:
-    """
-    Busca conversas abertas com a tag CSINTERNO.
-    Inclui campos necessários para:
-    - Time (admin_assignee_id -> admin_map -> TEAM_MAP)
-    - Assunto (tags)
-    - Descrição (custom_attributes da conversa)
-    - TMA (statistics)
-    - Contacts (para mapear Regional)
-    """
-    url = f"{base_url}/conversations/search"
-    base_query = {
-        "query": {
-            "operator": "AND",
-            "value": [
-                {"field": "open", "operator": "=", "value": True},
-                {"field": "state", "operator": "=", "value": "open"},
-                {"field": "tag_ids", "operator": "IN", "value": ["11077847"]},
-                {"field": "tag_ids", "operator": "NIN", "value": ["11457806"]}
-            ],
-        }
-    }
-    fields_block = {
-        "fields": {
-            "conversations": [
-                "id",
-                "created_at",
-                "state",
-                "open",
-                "admin_assignee_id",
-                "contacts",
-                "tags",
-                "statistics",
-                "custom_attributes",
-            ]
-        }
-    }
-
-    slim = []
-    starting_after = None
-    while True:
-        body = {**base_query, **fields_block, "pagination": {"per_page": PER_PAGE}}
-        if starting_after:
-            body["pagination"]["starting_after"] = starting_after
-        r = requests.post(url, headers=hdrs, json=body, timeout=TIMEOUT)
-        r.raise_for_status()
-        data = r.json()
-        batch = data.get("conversations") or data.get("data") or []
-        if not batch:
-            break
-        slim.extend(batch)
-        starting_after = (data.get("pagination") or {}).get("next")
-        if not starting_after:
-            break
-    return slim
-
-# -------------------------
-# Contacts: cache simples por execução (Cidade/Lugar)
-_CONTACT_INFO_CACHE: Dict[str, Dict[str, Optional[str]]] = {}
-
-def fetch_contact_info(base_url: str, hdrs: dict, contact_id: str) -> Dict[str, Optional[str]]:
-    """
-    Retorna {"Cidade": <location.city ou "">, "Filial": <custom_attributes['Lugar'] ou "">}.
-    """
-    if not contact_id:
-        return {"Cidade": "", "Filial": ""}
-    if contact_id in _CONTACT_INFO_CACHE:
-        return _CONTACT_INFO_CACHE[contact_id]
-
-    url = f"{base_url}/contacts/{contact_id}"
-    try:
-        r = requests.get(url, headers=hdrs, timeout=TIMEOUT)
-        r.raise_for_status()
-        data = r.json() or {}
-        loc = data.get("location") or {}
-        cidade = loc.get("city") or ""
-        ca = data.get("custom_attributes") or {}
-        filial = ca.get("Lugar") or ca.get("lugar") or ca.get("LUGAR") or ""
-        out = {"Cidade": cidade, "Filial": filial}
-        _CONTACT_INFO_CACHE[contact_id] = out
-        return out
-    except Exception:
-        out = {"Cidade": "", "Filial": ""}
-        _CONTACT_INFO_CACHE[contact_id] = out
-        return out
-
-# -------------------------
-# UI
-# -------------------------
-st.set_page_config(page_title="Torre de Controle - CS Interno", layout="wide")
-
-# Rerun periódico
-autorefresh_counter = st_autorefresh(interval=REFRESH_SECS * 1000, key="periodic_refresh")
-
-st.caption(
-    f"(debug) refresh_counter={autorefresh_counter} • "
-    f"expires_at={st.session_state.get('expires_at')} • "
-    f"now_ts={int(time.time())}"
-)
-
-# Estilo compacto
-st.markdown(
-    """
-    <style>
-      div[data-testid="stDataFrame"] table { font-size: 14px; line-height: 1.1; }
-      div[data-testid="stDataFrame"] td, div[data-testid="stDataFrame"] th {
-        padding-top: 6px !important; padding-bottom: 6px !important;
-        padding-left: 6px !important; padding-right: 6px !important;
-      }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
-
-# Estado do horário da última atualização (UTC epoch) — só muda ao final da coleta
-if "last_refresh_ts" not in st.session_state:
-    st.session_state["last_refresh_ts"] = None
-
-def fmt_last_refresh_minus3() -> str:
-    ts = st.session_state.get("last_refresh_ts")
-    if ts is None:
-        return "—"
-    dt = datetime.fromtimestamp(ts, tz=timezone.utc) - timedelta(hours=3)
-    return dt.strftime("%d/%m/%Y %H:%M:%S")
-
-# ===== Cabeçalho (título + relógio) =====
-header = st.container()
-with header:
-    st.title("Torre de Controle - CS Interno")
-    caption_ph = st.empty()  # placeholder para o relógio
-
-def update_caption():
-    caption_ph.caption(f"Atualiza automaticamente a cada 10 minutos • Última atualização em: {fmt_last_refresh_minus3()}")
-
-# Renderiza o relógio imediatamente (pode ser “—” na 1ª carga)
-update_caption()
-
-# ===== Barra de progresso no topo (visível durante a atualização) =====
-progress_ph = st.empty()
-
-# ===== Filtro (sempre antes da tabela) =====
-top_controls = st.container()
-with top_controls:
-    regionais_disponiveis = ["Todos"] + sorted(list(regionais_ui.keys())) + ["NÃO MAPEADO"]
-    mem = st.session_state.get("regional_sel_memory", "Todos")
-    try:
-        default_idx = regionais_disponiveis.index(mem) if mem in regionais_disponiveis else 0
-    except Exception:
-        default_idx = 0
-    regional_sel = st.selectbox("Filtrar por Regional", options=regionais_disponiveis, index=default_idx)
-    st.session_state["regional_sel_memory"] = regional_sel
-
-# ===== Subtítulo + Cards + Tabela =====
-subtitle_ph = st.empty()   # legenda da tabela
-metrics_ph = st.empty()    # cartões
-table_ph = st.empty()      # grade da tabela
-
-def render_table(df: pd.DataFrame):
-    """
-    View:
-    - Cards: TMA geral (min), Qtd tickets com TMA > 2h
-    - Tabela: tickets com TMA > 20 min, ordenados por TMA (maior→menor),
-      colunas: Time | Filial | Assunto | Descrição | TMA (min).
-    """
-    df = df.copy()
-
-    # Filtro de regional
-    if regional_sel != "Todos":
-        df = df.loc[df["Regional"] == regional_sel].copy()
-
-    # Sem dados
-    if df.empty:
-        subtitle_ph.empty()
-        metrics_ph.empty()
-        with table_ph.container():
-            st.subheader("Dados em tempo real")
-            st.info("Sem dados para exibir.")
-        return
-
-    # Garante TMA numérico
-    df["TMA_min"] = pd.to_numeric(df["TMA_min"], errors="coerce")
-
-    # Cards
-    tma_geral = df["TMA_min"].mean(skipna=True)
-    qtd_tma_maior_2h = (df["TMA_min"] > 120).sum()
-
-    with metrics_ph.container():
-        col1, col2 = st.columns(2)
-        with col1:
-            st.metric("TMA geral (min)", f"{tma_geral:.1f}" if pd.notna(tma_geral) else "—")
-        with col2:
-            st.metric("Qtd tickets com TMA > 2h", int(qtd_tma_maior_2h))
-
-    # Tabela: TMA > 20 min, maior → menor
-    df_tab = df[df["TMA_min"] > 20].copy()
-    if df_tab.empty:
-        subtitle_ph.caption("Nenhum ticket com TMA > 20 minutos para os filtros selecionados.")
-        with table_ph.container():
-            st.table(pd.DataFrame(columns=["Filial", "Time", "Assunto", "Descrição", "TMA (min)"]))
-        return
-
-    df_tab = df_tab.sort_values("TMA_min", ascending=False, kind="stable")
-
-    subtitle_ph.caption("Tickets com TMA > 20 minutos, ordenados do maior para o menor TMA.")
-
-    # Tabela final com Filial
-    df_display = df_tab[["Filial", "Time", "Assunto", "Descrição", "TMA_min"]].rename(
-        columns={"TMA_min": "TMA (min)"}
-    )
-
-    # Reset de índice (vamos tentar esconder depois)
-    df_display = df_display.reset_index(drop=True)
-
-    # ------------ CONFIG DE LARGURA POR COLUNA (AJUSTE AQUI) ------------
-    COL_WIDTHS = {
-        "Filial": "8rem",
-        "Time": "14rem",
-        "Assunto": "16rem",
-        "Descrição": "32rem",
-        "TMA (min)": "7rem",
-    }
-    # Ajuste esses valores se quiser mais/menos espaço em cada coluna
-    # --------------------------------------------------------------------
-
-    # Gradiente TMA
-    def red_white_gradient(col: pd.Series):
-        ser = pd.to_numeric(col, errors="coerce")
-        vmin = float(ser.min())
-        vmax = float(ser.max())
-        if math.isnan(vmin) or math.isnan(vmax) or not math.isfinite(vmin) or not math.isfinite(vmax):
-            return ["background-color: rgb(255,255,255); color: black;"] * len(col)
-        rng = vmax - vmin
-        if rng == 0:
-            return ["background-color: rgb(255,255,255); color: black;"] * len(col)
-
-        styles = []
-        for v in ser:
-            if v is None or math.isnan(v) or not math.isfinite(v):
-                styles.append("")
-                continue
-            t = (v - vmin) / rng
-            t = max(0.0, min(1.0, t))
-            g = int(round(255 * (1.0 - t)))  # branco → vermelho
-            styles.append(f"background-color: rgb(255,{g},{g}); color: black;")
-        return styles
-
-    styled = df_display.style
-
-    # Formato TMA
-    styled = styled.format({"TMA (min)": "{:.1f}"})
-
-    # Gradiente em TMA
-    styled = styled.apply(red_white_gradient, subset=["TMA (min)"])
-
-    # Cores de texto
-    styled = (
-        styled
-        .set_properties(subset=["Filial", "Time", "Assunto", "Descrição"], **{"color": "white"})
-        .set_properties(subset=["TMA (min)"], **{"color": "black"})
-    )
-
-    # Tudo alinhado à esquerda
-    styled = styled.set_properties(
-        subset=df_display.columns,
-        **{"text-align": "left"}
-    )
-
-    # Quebra de linha na descrição; linha cresce pra caber
-    styled = styled.set_properties(
-        subset=["Descrição"],
-        **{
-            "white-space": "normal",
-            "word-wrap": "break-word",
-            "overflow-wrap": "break-word",
-        },
-    )
-
-    # Aplicar largura máxima configurada por coluna (sem min-width para não forçar scroll)
-    for col, width in COL_WIDTHS.items():
-        if col in df_display.columns:
-            styled = styled.set_properties(
-                subset=[col],
-                **{
-                    "max-width": width,
-                },
-            )
-
-    # Tentar ocultar índice (nem sempre 100%, mas ajuda)
-    try:
-        styled = styled.hide(axis="index")
-    except Exception:
-        pass
-
-    # CSS extra para tentar esconder cabeçalho/célula do índice em versões mais novas
-    styled = styled.set_table_styles(
-        [
-            {"selector": "th.row_heading", "props": [("display", "none")]},
-            {"selector": "td.row_heading", "props": [("display", "none")]},
-            {"selector": "th.blank", "props": [("display", "none")]},
-        ],
-        overwrite=False,
-    )
-
-    with table_ph.container():
-        st.table(styled)
-
-# Exibe a última tabela conhecida; se não houver timestamp ainda, marca referência
-rows_df_old = st.session_state.get("rows_df")
-if rows_df_old is not None and st.session_state.get("last_refresh_ts") is None:
-    st.session_state["last_refresh_ts"] = time.time()
-    update_caption()
-if rows_df_old is not None:
-    render_table(rows_df_old)
-
-# ===== Coleta com etapas e atualização do relógio =====
-def collect_rows(progress_cb=None) -> pd.DataFrame:
-    def step(p, txt):
-        if callable(progress_cb):
-            try:
-                progress_cb(int(p), txt)
-            except Exception:
-                pass
-
-    auth = get_auth()
-    base_url = (auth.get("INTERCOM_BASE_URL") or "https://api.intercom.io").rstrip("/")
-    hdrs = _headers(auth)
-
-    # 1) Conversas
-    step(10, "Carregando conversas…")
-    slim = fetch_conversations(base_url, hdrs)
-
-    # 2) Responsáveis
-    step(35, "Mapeando responsáveis…")
-    admin_map = fetch_admin_map(base_url, hdrs)
-
-    # 3) Contatos → Lugar/Filial/Regional
-    step(55, "Obtendo Lugar/Filial/Regional…")
-    contact_map: Dict[str, Dict[str, Optional[str]]] = {}
-    total = max(1, len(slim))
-    for i, obj in enumerate(slim, start=1):
-        contacts_struct = obj.get("contacts") or {}
-        contact_list = contacts_struct.get("contacts") or []
-        contact_id = (contact_list[0] or {}).get("id") if (contact_list and isinstance(contact_list, list)) else None
-
-        if contact_id and contact_id not in _CONTACT_INFO_CACHE:
-            cinfo = fetch_contact_info(base_url, hdrs, contact_id)
-        else:
-            cinfo = _CONTACT_INFO_CACHE.get(contact_id, {"Cidade": "", "Filial": ""}) if contact_id else {"Cidade": "", "Filial": ""}
-
-        filial_name = cinfo.get("Filial") or ""
-        filial_code = filiais.get(filial_name) if filial_name else None
-        regional = code_to_regional.get(filial_code, "NÃO MAPEADO")
-
-        contact_map[contact_id or ""] = {
-            "Cidade": cinfo.get("Cidade", ""),
-            "Filial": filial_name,
-            "FilialCodigo": filial_code if filial_code is not None else "",
-            "Regional": regional,
-        }
-
-        if i % 5 == 0 or i == total:
-            frac = i / total
-            pct = 55 + int(30 * frac)  # 55% → 85%
-            step(pct, f"Obtendo Lugar/Filial/Regional… ({i}/{total})")
-
-    # 4) Montagem por ticket
-    step(90, "Finalizando…")
-    rows = []
-    now_ts = datetime.now(timezone.utc).timestamp()
-    for obj in slim:
-        if obj.get("state") != "open" or obj.get("open") is not True:
-            continue
-
-        # TMA = tempo em aberto = agora - created_at
-        try:
-            created_at = float(obj.get("created_at"))
-        except Exception:
-            continue  # se não tiver created_at válido, pula
-
-        tma_min = max(0.0, (now_ts - created_at) / 60.0)
-
-        # Responsável / Time
-        aid = obj.get("admin_assignee_id")
-        admin_name = admin_map.get(str(aid)) if aid is not None else None
-        resp = admin_name or "Não atribuído"
-        if resp in EXCLUDE_ADMINS:
-            continue
-
-        time_group = map_to_team_or_self(resp)
-
-        # Filtro: remover Time = Supply (normalizado)
-        if _normalize(time_group) == "supply":
-            continue
-
-        # Assunto via tags
-        tags_block = obj.get("tags") or {}
-        assunto = extract_assunto_from_tags(tags_block)
-
-        # Descrição via custom_attributes da conversa
-        conv_custom_attrs = obj.get("custom_attributes") or {}
-        descricao = extract_descricao(conv_custom_attrs)
-
-        # Contact / Regional
-        contacts_struct = obj.get("contacts") or {}
-        contact_list = contacts_struct.get("contacts") or []
-        contact_id = (contact_list[0] or {}).get("id") if (contact_list and isinstance(contact_list, list)) else None
-        cinfo = contact_map.get(contact_id or "", {})
-
-        rows.append({
-            "ConversationId": obj.get("id"),
-            "Time": time_group,
-            "Assunto": assunto,
-            "Descrição": descricao,
-            "TMA_min": tma_min,
-            "Responsavel": resp,
-            "ContactId": contact_id or "",
-            "Cidade": cinfo.get("Cidade", ""),
-            "Filial": cinfo.get("Filial", ""),
-            "FilialCodigo": cinfo.get("FilialCodigo", ""),
-            "Regional": cinfo.get("Regional", "NÃO MAPEADO"),
-        })
-
-    cols = [
-        "ConversationId",
-        "Time",
-        "Assunto",
-        "Descrição",
-        "TMA_min",
-        "Responsavel",
-        "ContactId",
-        "Cidade",
-        "Filial",
-        "FilialCodigo",
-        "Regional",
-    ]
-    step(100, "Concluído")
-    return pd.DataFrame(rows, columns=cols)
-
-# Expiração (10 min)
-now_ts = time.time()
-expired = ("expires_at" not in st.session_state) or (now_ts >= st.session_state["expires_at"])
-
-if expired or rows_df_old is None:
-    # Barra de progresso VISÍVEL no topo com etapas reais
-    bar = progress_ph.progress(0, text="Preparando atualização…")
-
-    def progress_cb(pct, text):
-        try:
-            bar.progress(int(pct), text=text)
-        except Exception:
-            pass
-
-    try:
-        rows_df_new = collect_rows(progress_cb=progress_cb)
-    except Exception as e:
-        progress_ph.empty()
-        st.error(f"Falha na atualização: {e}")
-    else:
-        # Grava novo estado e horário REAL da atualização
-        st.session_state["rows_df"] = rows_df_new
-        st.session_state["expires_at"] = time.time() + REFRESH_SECS
-        st.session_state["last_refresh_ts"] = time.time()
-        # Atualiza relógio imediatamente após terminar
-        update_caption()
-        progress_ph.empty()
-        render_table(rows_df_new)
-else:
-    # Ainda válido: mantém tabela congelada, sem barra
-    pass
-
-
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Torre de Controle - CS Interno (Streamlit)
+# - Filial vem de custom_attributes["Lugar"] do contato
+# - Mapeia Filial -> código -> Regional
+# - Congela a tabela durante atualização (duplo buffer)
+# - Atualiza automaticamente a cada 10 minutos (sem derrubar a tabela)
+# - Horário exibido com ajuste de -3 horas (somente na UI)
+
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import orjson
+import pandas as pd
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from matplotlib.colors import LinearSegmentedColormap
+
+from map import (
+    FILIAL_CODE_NORM,
+    FILIAL_TO_REGIONAL,
+    REGIONAIS_DISPONIVEIS,
+    TEAM_MAP,
+    _normalize,
+)
+
+TIMEOUT = (5, 60)
+PER_PAGE = 150
+REFRESH_SECS = 600  # 10 minutos
+CONTACT_WORKERS = 16  # requisições de contato em paralelo
+EXCLUDE_ADMINS = {"Suporte Mottu", "Não atribuído"}
+
+# Colormap do gradiente da coluna TMA (branco → vermelho)
+WR_CMAP = LinearSegmentedColormap.from_list("wr", ["#ffffff", "#ff0000"])
+
+# Sessão compartilhada (keep-alive + pool de conexões para a API do Intercom).
+# st.cache_resource garante uma única sessão por processo, compartilhada entre
+# todas as sessões/reruns do Streamlit.
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    s = requests.Session()
+    s.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(["GET", "POST"]),
+            ),
+        ),
+    )
+    return s
+
+SESSION = get_session()
+
+# -------------------------------------------------------------------
+# Mapeamento de Time (lookups derivados vivem em map.py — avaliados uma
+# única vez por processo, fora do rerun do script)
+
+# Comparação de exclusão tolerante a caixa/acentos, calculada uma vez
+EXCLUDE_ADMINS_NORM = frozenset(_normalize(x) for x in EXCLUDE_ADMINS)
+
+@lru_cache(maxsize=4096)
+def map_to_team_or_self(responsavel: str) -> str:
+    team = TEAM_MAP.get(_normalize(responsavel))
+    if team:
+        return team
+    return responsavel or "Não atribuído"
+
+# -------------------------
+# Helpers para Assunto / TMA / Descrição
+def extract_assunto_from_tags(tags_block: Optional[dict]) -> str:
+    """
+    Escolhe a tag que tem pelo menos 3 hifens '-' e pega o texto entre o 2º e o 3º hífen.
+    Ex.: 'CSINTERNO - ONBOARDING - ERRO AO ESCOLHER PLANO - HUMANO'
+         -> 'ERRO AO ESCOLHER PLANO'
+    """
+    if not tags_block:
+        return ""
+    tags_list = tags_block.get("tags") or []
+    main_name = ""
+    for t in tags_list:
+        name = (t.get("name") or "").strip()
+        if name.count("-") >= 3:
+            main_name = name
+            break
+    if not main_name:
+        return ""
+    parts = main_name.split("-")
+    if len(parts) >= 4:
+        return parts[2].strip()
+    # fallback se vier fora do padrão
+    return main_name
+
+def extract_descricao(conv_custom_attrs: Optional[dict]) -> str:
+    if not conv_custom_attrs:
+        return ""
+    return conv_custom_attrs.get("CS Interno - Descrição") or ""
+
+# -------------------------
+# Autenticação
+def get_auth():
+    if not getattr(st, "secrets", None) or "auth" not in st.secrets:
+        raise RuntimeError("Segredos não encontrados. No Streamlit, crie .streamlit/secrets.toml com [auth].")
+    auth = st.secrets["auth"]
+    if not (auth.get("INTERCOM_BEARER")):
+        raise RuntimeError("Chave ausente em [auth]: INTERCOM_BEARER")
+    return auth
+
+@lru_cache(maxsize=4)
+def _build_headers(bearer: str, version: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {bearer}",
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "Intercom-Version": version,
+        "Accept-Encoding": "br, gzip, deflate",
+        "Connection": "keep-alive",
+    }
+
+def _headers(auth: dict) -> dict:
+    return _build_headers(
+        (auth.get("INTERCOM_BEARER") or "").strip(),
+        auth.get("INTERCOM_VERSION", "2.14"),
+    )
+
+# -------------------------
+# Fetch Intercom
+# ETag + último roster bom de /admins, para GET condicional quando o TTL vence
+@st.cache_resource(show_spinner=False)
+def _admins_state() -> dict:
+    return {}
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_admin_map(base_url: str) -> Dict[str, str]:
+    # O roster de admins muda raramente; TTL de 1h evita refazer /admins a cada
+    # refresh e o If-None-Match transforma o refetch pós-TTL num 304 sem corpo
+    url = f"{base_url}/admins"
+    state = _admins_state()
+    hdrs = None
+    if state.get("etag") and state.get("map"):
+        hdrs = {"If-None-Match": state["etag"]}
+    r = SESSION.get(url, headers=hdrs, timeout=TIMEOUT)
+    if r.status_code == 304 and state.get("map"):
+        return state["map"]
+    r.raise_for_status()
+    admins = (orjson.loads(r.content) or {}).get("admins", [])
+    amap = {str(a.get("id")): a.get("name") for a in admins if a.get("id") is not None}
+    state["etag"] = r.headers.get("ETag")
+    state["map"] = amap
+    return amap
+
+def fetch_conversations(base_url: str) -> Iterator[List[dict]]:
+    """
+    Busca conversas abertas com a tag CSINTERNO, gerando uma página filtrada
+    por vez — o consumidor pode pré-buscar contatos enquanto a próxima página
+    ainda viaja.
+    Inclui campos necessários para:
+    - Time (admin_assignee_id -> admin_map -> TEAM_MAP)
+    - Assunto (tags)
+    - Descrição (custom_attributes da conversa)
+    - TMA (created_at)
+    - Contacts (para mapear Regional)
+    """
+    url = f"{base_url}/conversations/search"
+    base_query = {
+        "query": {
+            "operator": "AND",
+            "value": [
+                {"field": "open", "operator": "=", "value": True},
+                {"field": "state", "operator": "=", "value": "open"},
+                {"field": "tag_ids", "operator": "IN", "value": ["11077847"]},
+                {"field": "tag_ids", "operator": "NIN", "value": ["11457806"]}
+            ],
+        }
+    }
+    fields_block = {
+        "fields": {
+            "conversations": [
+                "id",
+                "created_at",
+                "state",
+                "open",
+                "admin_assignee_id",
+                "contacts",
+                "tags",
+                "custom_attributes",
+            ]
+        }
+    }
+
+    starting_after = None
+    body = {**base_query, **fields_block, "pagination": {"per_page": PER_PAGE}}
+    while True:
+        if starting_after:
+            body["pagination"]["starting_after"] = starting_after
+        else:
+            body["pagination"].pop("starting_after", None)
+        # Content-Type já vem dos headers; orjson.dumps evita o encoder do stdlib
+        r = SESSION.post(url, data=orjson.dumps(body), timeout=TIMEOUT)
+        r.raise_for_status()
+        if not r.content:
+            break  # corpo vazio: nada a parsear
+        data = orjson.loads(r.content)
+        batch = data.get("conversations") or data.get("data") or []
+        if not batch:
+            break
+        # Filtro de estado aplicado já na chegada da página (evita re-filtrar depois)
+        yield [c for c in batch if c.get("state") == "open" and c.get("open") is True]
+        starting_after = (data.get("pagination") or {}).get("next")
+        if not starting_after:
+            break
+
+# -------------------------
+# Contacts: cache persistente entre reruns (Cidade/Lugar)
+def _first_contact_id(obj: dict) -> Optional[str]:
+    """Extrai o id do primeiro contato da conversa (ou None)."""
+    contact_list = (obj.get("contacts") or {}).get("contacts") or []
+    if not isinstance(contact_list, list) or not contact_list:
+        return None
+    return (contact_list[0] or {}).get("id")
+
+
+# Cache de contatos compartilhado entre sessões/abas via st.cache_resource:
+# depois do primeiro ciclo quente, só ids inéditos geram chamada à API.
+@st.cache_resource(show_spinner=False)
+def _contact_cache() -> Dict[str, Dict[str, Optional[str]]]:
+    return {}
+
+
+@st.cache_resource(show_spinner=False)
+def _contact_cache_lock() -> threading.Lock:
+    return threading.Lock()
+
+
+def _parse_contact(data: dict) -> Dict[str, Optional[str]]:
+    """Extrai {"Cidade", "Filial"} de um objeto de contato do Intercom."""
+    loc = data.get("location") or {}
+    ca = data.get("custom_attributes") or {}
+    # "Lugar" chega com caixa inconsistente; um único probe no comum e, se
+    # falhar, uma varredura casefold em vez de uma sonda por variação
+    filial = ca.get("Lugar")
+    if not filial:
+        filial = next((v for k, v in ca.items() if k.casefold() == "lugar"), "")
+    return {
+        "Cidade": loc.get("city") or "",
+        "Filial": filial or "",
+    }
+
+
+def fetch_contacts_bulk(base_url: str, contact_ids: List[str]) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Busca contatos em lote via POST /contacts/search (id IN [...]):
+    ~ceil(N/150) chamadas em vez de N GETs individuais.
+    """
+    url = f"{base_url}/contacts/search"
+    info: Dict[str, Dict[str, Optional[str]]] = {}
+    ids = list(contact_ids)
+    for i in range(0, len(ids), PER_PAGE):
+        chunk = ids[i:i + PER_PAGE]
+        body = {
+            "query": {"field": "id", "operator": "IN", "value": chunk},
+            "pagination": {"per_page": PER_PAGE},
+        }
+        starting_after = None
+        while True:
+            if starting_after:
+                body["pagination"]["starting_after"] = starting_after
+            else:
+                body["pagination"].pop("starting_after", None)
+            r = SESSION.post(url, data=orjson.dumps(body), timeout=TIMEOUT)
+            r.raise_for_status()
+            data = orjson.loads(r.content)
+            for c in data.get("data") or data.get("contacts") or []:
+                cid = c.get("id")
+                if cid:
+                    info[cid] = _parse_contact(c)
+            nxt = (data.get("pages") or {}).get("next") or (data.get("pagination") or {}).get("next")
+            starting_after = nxt.get("starting_after") if isinstance(nxt, dict) else nxt
+            if not starting_after:
+                break
+    return info
+
+
+@st.cache_data(ttl=24 * 3600, show_spinner=False)
+def fetch_contact_info(base_url: str, contact_id: str) -> Dict[str, Optional[str]]:
+    """
+    Retorna {"Cidade": <location.city ou "">, "Filial": <custom_attributes['Lugar'] ou "">}.
+    Cacheado por 24h via st.cache_data, então reruns quentes não refazem /contacts.
+    """
+    if not contact_id:
+        return {"Cidade": "", "Filial": ""}
+
+    url = f"{base_url}/contacts/{contact_id}"
+    try:
+        r = SESSION.get(url, timeout=TIMEOUT)
+        r.raise_for_status()
+        return _parse_contact(orjson.loads(r.content) or {})
+    except Exception:
+        return {"Cidade": "", "Filial": ""}
+
+# -------------------------
+# UI
+# -------------------------
+st.set_page_config(page_title="Torre de Controle - CS Interno", layout="wide")
+
+# Estilo compacto
+st.markdown(
+    """
+    <style>
+      div[data-testid="stDataFrame"] table { font-size: 14px; line-height: 1.1; }
+      div[data-testid="stDataFrame"] td, div[data-testid="stDataFrame"] th {
+        padding-top: 6px !important; padding-bottom: 6px !important;
+        padding-left: 6px !important; padding-right: 6px !important;
+      }
+    </style>
+    """,
+    unsafe_allow_html=True,
+)
+
+# Estado do horário da última atualização (UTC epoch) — só muda ao final da coleta
+if "last_refresh_ts" not in st.session_state:
+    st.session_state["last_refresh_ts"] = None
+
+# Fuso fixo de exibição (-3h), criado uma vez
+TZ_MINUS3 = timezone(timedelta(hours=-3))
+
+def fmt_last_refresh_minus3() -> str:
+    ts = st.session_state.get("last_refresh_ts")
+    if ts is None:
+        return "—"
+    return datetime.fromtimestamp(ts, tz=TZ_MINUS3).strftime("%d/%m/%Y %H:%M:%S")
+
+# ===== Cabeçalho =====
+header = st.container()
+with header:
+    st.title("Torre de Controle - CS Interno")
+
+# ===== Filtro (sempre antes da tabela) =====
+top_controls = st.container()
+with top_controls:
+    mem = st.session_state.get("regional_sel_memory", "Todos")
+    try:
+        default_idx = REGIONAIS_DISPONIVEIS.index(mem) if mem in REGIONAIS_DISPONIVEIS else 0
+    except Exception:
+        default_idx = 0
+    regional_sel = st.selectbox("Filtrar por Regional", options=REGIONAIS_DISPONIVEIS, index=default_idx)
+    st.session_state["regional_sel_memory"] = regional_sel
+
+def _build_styled(df_tab: pd.DataFrame):
+    """Monta o Styler da tabela (formato, gradiente, larguras) a partir do
+    recorte já filtrado/ordenado."""
+    # Tabela final com Filial
+    df_display = df_tab[["Filial", "Time", "Assunto", "Descrição", "TMA_min"]].rename(
+        columns={"TMA_min": "TMA (min)"}
+    )
+
+    # Reset de índice (vamos tentar esconder depois)
+    df_display = df_display.reset_index(drop=True)
+
+    # ------------ CONFIG DE LARGURA POR COLUNA (AJUSTE AQUI) ------------
+    COL_WIDTHS = {
+        "Filial": "8rem",
+        "Time": "14rem",
+        "Assunto": "16rem",
+        "Descrição": "32rem",
+        "TMA (min)": "7rem",
+    }
+    # Ajuste esses valores se quiser mais/menos espaço em cada coluna
+    # --------------------------------------------------------------------
+
+    # Um único stylesheet com seletores por coluna (classes colN do Styler) em
+    # vez de set_properties por célula: o HTML deixa de carregar ~5 estilos
+    # inline por célula e o payload enviado ao browser encolhe bastante.
+    # Inclui o CSS que esconde cabeçalho/célula do índice.
+    table_styles = [
+        {"selector": "th.row_heading", "props": [("display", "none")]},
+        {"selector": "td.row_heading", "props": [("display", "none")]},
+        {"selector": "th.blank", "props": [("display", "none")]},
+    ]
+    for i, col in enumerate(df_display.columns):
+        props = [
+            ("text-align", "left"),
+            ("color", "black" if col == "TMA (min)" else "white"),
+        ]
+        if col in COL_WIDTHS:
+            # Largura máxima por coluna (sem min-width para não forçar scroll)
+            props.append(("max-width", COL_WIDTHS[col]))
+        if col == "Descrição":
+            # Quebra de linha na descrição; linha cresce pra caber
+            props += [
+                ("white-space", "normal"),
+                ("word-wrap", "break-word"),
+                ("overflow-wrap", "break-word"),
+            ]
+        table_styles.append({"selector": f"td.col{i}", "props": props})
+
+    styled = df_display.style
+
+    # Formato TMA
+    styled = styled.format({"TMA (min)": "{:.1f}"})
+
+    # Gradiente branco → vermelho em TMA (colormap vetorizado do pandas/matplotlib)
+    styled = styled.background_gradient(
+        cmap=WR_CMAP, subset=["TMA (min)"], text_color_threshold=0.0
+    )
+
+    # Tentar ocultar índice (nem sempre 100%, mas ajuda)
+    try:
+        styled = styled.hide(axis="index")
+    except Exception:
+        pass
+
+    styled = styled.set_table_styles(table_styles, overwrite=False)
+
+    return styled
+
+
+def render_table(df: pd.DataFrame, regional_sel: str, subtitle_ph, metrics_ph, table_ph):
+    """
+    View:
+    - Cards: TMA geral (min), Qtd tickets com TMA > 2h
+    - Tabela: tickets com TMA > 20 min, ordenados por TMA (maior→menor),
+      colunas: Time | Filial | Assunto | Descrição | TMA (min).
+    Os placeholders são criados dentro do fragment de refresh (Streamlit não
+    permite que um fragment escreva em containers criados fora dele).
+    Filtro/ordenação/Styler são memoizados por (regional, coleta): reruns com
+    os mesmos dados e filtro só redesenham, sem recomputar.
+    """
+    key = (regional_sel, df.attrs.get("fetched_at"))
+    memo = st.session_state.get("_render_memo")
+    if not memo or memo.get("key") != key:
+        view = df if regional_sel == "Todos" else df.loc[df["Regional"] == regional_sel]
+        memo = {"key": key, "empty": view.empty, "styled": None}
+        if not view.empty:
+            # Cards (TMA_min já sai float64 do collect_rows — sem coerção aqui)
+            memo["tma_geral"] = view["TMA_min"].mean(skipna=True)
+            memo["qtd_tma_maior_2h"] = int((view["TMA_min"] > 120).sum())
+            # Tabela: TMA > 20 min, maior → menor
+            df_tab = view.loc[view["TMA_min"] > 20]
+            if not df_tab.empty:
+                memo["styled"] = _build_styled(
+                    df_tab.sort_values("TMA_min", ascending=False, kind="stable")
+                )
+        st.session_state["_render_memo"] = memo
+
+    # Sem dados
+    if memo["empty"]:
+        subtitle_ph.empty()
+        metrics_ph.empty()
+        with table_ph.container():
+            st.subheader("Dados em tempo real")
+            st.info("Sem dados para exibir.")
+        return
+
+    with metrics_ph.container():
+        col1, col2 = st.columns(2)
+        with col1:
+            tma_geral = memo["tma_geral"]
+            st.metric("TMA geral (min)", f"{tma_geral:.1f}" if pd.notna(tma_geral) else "—")
+        with col2:
+            st.metric("Qtd tickets com TMA > 2h", memo["qtd_tma_maior_2h"])
+
+    if memo["styled"] is None:
+        subtitle_ph.caption("Nenhum ticket com TMA > 20 minutos para os filtros selecionados.")
+        with table_ph.container():
+            st.table(pd.DataFrame(columns=["Filial", "Time", "Assunto", "Descrição", "TMA (min)"]))
+        return
+
+    subtitle_ph.caption("Tickets com TMA > 20 minutos, ordenados do maior para o menor TMA.")
+    with table_ph.container():
+        st.table(memo["styled"])
+
+# ===== Coleta com etapas e atualização do relógio =====
+# st.cache_data(ttl=REFRESH_SECS): uma coleta por janela de 10 min, compartilhada
+# entre todas as sessões/abas. O callback de progresso fica fora da chave de cache.
+@st.cache_data(ttl=REFRESH_SECS, show_spinner=False)
+def collect_rows(_progress_cb=None) -> pd.DataFrame:
+    def step(p, txt):
+        if callable(_progress_cb):
+            try:
+                _progress_cb(int(p), txt)
+            except Exception:
+                pass
+
+    auth = get_auth()
+    base_url = (auth.get("INTERCOM_BASE_URL") or "https://api.intercom.io").rstrip("/")
+    # Headers entram uma vez na sessão compartilhada; os fetchers não recebem
+    # mais hdrs e os workers reutilizam o mesmo dict
+    SESSION.headers.update(_headers(auth))
+
+    # 1+2+3) Pipeline: /admins em paralelo com a 1ª página de conversas; a
+    # cada página recebida, a pré-busca de contatos inéditos parte em
+    # background enquanto a próxima página ainda viaja.
+    step(10, "Carregando conversas e responsáveis…")
+    cache = _contact_cache()
+    lock = _contact_cache_lock()
+
+    slim: List[dict] = []
+    responsaveis: List[str] = []
+    times: List[str] = []
+    contact_ids: List[Optional[str]] = []
+    prefetches = []
+    prefetching: set = set()
+    admin_ok = admin_team = None
+
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        f_admins = ex.submit(fetch_admin_map, base_url)
+        for page in fetch_conversations(base_url):
+            if admin_ok is None:
+                admin_map = f_admins.result()
+                # Normalização e Time resolvidos UMA vez por admin (dezenas),
+                # não por conversa (centenas). Exclusões acontecem antes da
+                # fase de contatos: conversa descartada não gera HTTP de contato.
+                admin_ok = {
+                    aid: name for aid, name in admin_map.items()
+                    if _normalize(name) not in EXCLUDE_ADMINS_NORM
+                }
+                admin_team = {aid: map_to_team_or_self(name) for aid, name in admin_ok.items()}
+
+            page_cids = []
+            for obj in page:
+                aid = obj.get("admin_assignee_id")
+                aid = str(aid) if aid is not None else None
+                if aid not in admin_ok:
+                    continue
+                cid = _first_contact_id(obj)
+                slim.append(obj)
+                responsaveis.append(admin_ok[aid])
+                times.append(admin_team[aid])
+                contact_ids.append(cid)
+                if cid:
+                    page_cids.append(cid)
+
+            with lock:
+                new_ids = sorted({cid for cid in page_cids if cid not in cache} - prefetching)
+            if new_ids:
+                prefetching.update(new_ids)
+                prefetches.append(ex.submit(fetch_contacts_bulk, base_url, new_ids))
+            step(min(50, 15 + 5 * len(prefetches)), "Carregando conversas e contatos…")
+
+        if admin_ok is None:
+            f_admins.result()  # propaga erro de /admins mesmo sem conversas
+
+        step(55, "Obtendo Lugar/Filial/Regional…")
+        new_info: Dict[str, Dict[str, Optional[str]]] = {}
+        for fut in prefetches:
+            try:
+                new_info.update(fut.result())
+            except Exception:
+                pass  # ids que falharem caem no fallback por id abaixo
+
+    with lock:
+        cache.update(new_info)
+        unique_ids = {cid for cid in contact_ids if cid}
+        fetched: Dict[str, Dict[str, Optional[str]]] = {cid: cache[cid] for cid in unique_ids if cid in cache}
+
+    # GETs individuais apenas para o que a pré-busca não devolveu
+    missing = sorted(unique_ids - fetched.keys())
+    if missing:
+        fallback: Dict[str, Dict[str, Optional[str]]] = {}
+        with ThreadPoolExecutor(max_workers=min(CONTACT_WORKERS, len(missing))) as ex:
+            futures = {ex.submit(fetch_contact_info, base_url, cid): cid for cid in missing}
+            for fut in as_completed(futures):
+                fallback[futures[fut]] = fut.result()
+        with lock:
+            cache.update(fallback)
+        fetched.update(fallback)
+    step(85, "Obtendo Lugar/Filial/Regional…")
+
+    # fetched já contém exatamente os ids únicos — deriva código/regional direto
+    # dele, numa tabela colunar que entra no frame por um único merge
+    contact_records = []
+    for contact_id, cinfo in fetched.items():
+        filial_name = cinfo.get("Filial") or ""
+        filial_norm = _normalize(filial_name) if filial_name else ""
+        filial_code = FILIAL_CODE_NORM.get(filial_norm)
+        contact_records.append((
+            contact_id,
+            cinfo.get("Cidade") or "",
+            filial_name,
+            filial_code if filial_code is not None else "",
+            FILIAL_TO_REGIONAL.get(filial_norm, "NÃO MAPEADO"),
+        ))
+    contact_df = pd.DataFrame.from_records(
+        contact_records,
+        columns=["ContactId", "Cidade", "Filial", "FilialCodigo", "Regional"],
+    )
+
+    # 4) Montagem por ticket (colunar + vetorizada)
+    step(90, "Finalizando…")
+    now_ts = datetime.now(timezone.utc).timestamp()
+
+    df = pd.DataFrame({
+        "ConversationId": [obj.get("id") for obj in slim],
+        "created_at": [obj.get("created_at") for obj in slim],
+        "Responsavel": responsaveis,
+        "Time": times,
+        "Assunto": [extract_assunto_from_tags(obj.get("tags") or {}) for obj in slim],
+        "Descrição": [extract_descricao(obj.get("custom_attributes") or {}) for obj in slim],
+        "ContactId": [cid or "" for cid in contact_ids],
+    })
+
+    # state/open já foram filtrados na paginação; resta validar created_at
+    created = pd.to_numeric(df["created_at"], errors="coerce")
+    df = df.loc[created.notna()].copy()
+
+    # TMA = tempo em aberto = agora - created_at (vetorizado)
+    df["TMA_min"] = np.maximum(0.0, (now_ts - created.loc[df.index].to_numpy(dtype=np.float64)) / 60.0)
+
+    # Filtro: remover Time = Supply (normalizado)
+    df = df.loc[df["Time"].map(_normalize) != "supply"].copy()
+
+    # Contact / Regional: um único merge colunar em vez de quatro Series.map
+    df = df.merge(contact_df, on="ContactId", how="left")
+    for campo, default in (("Cidade", ""), ("Filial", ""), ("FilialCodigo", ""), ("Regional", "NÃO MAPEADO")):
+        df[campo] = df[campo].fillna(default)
+
+    cols = [
+        "ConversationId",
+        "Time",
+        "Assunto",
+        "Descrição",
+        "TMA_min",
+        "Responsavel",
+        "ContactId",
+        "Cidade",
+        "Filial",
+        "FilialCodigo",
+        "Regional",
+    ]
+    out = df.loc[:, cols].reset_index(drop=True)
+
+    # Strings muito repetidas viram category: o DataFrame fica bem menor no
+    # session_state entre reruns e filtros/agrupamentos operam sobre códigos int
+    for col in ("Time", "Responsavel", "Regional", "Filial", "Cidade"):
+        out[col] = out[col].astype("category")
+
+    # Momento real da coleta viaja junto com o DataFrame (sobrevive ao cache)
+    out.attrs["fetched_at"] = time.time()
+
+    step(100, "Concluído")
+    return out
+
+# ===== Bloco periódico: só esta parte re-executa a cada REFRESH_SECS =====
+@st.fragment(run_every=REFRESH_SECS)
+def refresh_block():
+    regional_sel = st.session_state.get("regional_sel_memory", "Todos")
+
+    # Placeholders criados dentro do fragment (relógio, barra, cards e tabela)
+    caption_ph = st.empty()
+    progress_ph = st.empty()
+    subtitle_ph = st.empty()
+    metrics_ph = st.empty()
+    table_ph = st.empty()
+
+    def update_caption():
+        caption_ph.caption(
+            f"Atualiza automaticamente a cada 10 minutos • Última atualização em: {fmt_last_refresh_minus3()}"
+        )
+
+    rows_df_old = st.session_state.get("rows_df")
+    if rows_df_old is not None and st.session_state.get("last_refresh_ts") is None:
+        st.session_state["last_refresh_ts"] = rows_df_old.attrs.get("fetched_at", time.time())
+    update_caption()
+
+    # A tabela antiga (congelada) e a barra só aparecem quando uma coleta REAL
+    # começa — em cache hit o callback nunca dispara e renderizamos uma única vez
+    frozen = {"shown": False}
+
+    def show_old_table():
+        if not frozen["shown"]:
+            frozen["shown"] = True
+            if rows_df_old is not None:
+                render_table(rows_df_old, regional_sel, subtitle_ph, metrics_ph, table_ph)
+
+    bar_state = {"bar": None}
+
+    def progress_cb(pct, text):
+        try:
+            show_old_table()
+            if bar_state["bar"] is None:
+                bar_state["bar"] = progress_ph.progress(0, text="Preparando atualização…")
+            bar_state["bar"].progress(int(pct), text=text)
+        except Exception:
+            pass
+
+    try:
+        rows_df_new = collect_rows(_progress_cb=progress_cb)
+    except Exception as e:
+        progress_ph.empty()
+        show_old_table()
+        if rows_df_old is not None:
+            # Falha transitória: mantém a última tabela boa em vez de derrubar a tela
+            st.warning(f"Falha na atualização: {e} — exibindo os últimos dados carregados.")
+        else:
+            st.error(f"Falha na atualização: {e}")
+    else:
+        # Grava novo estado e horário REAL da coleta (vem junto com o DataFrame)
+        st.session_state["rows_df"] = rows_df_new
+        st.session_state["last_refresh_ts"] = rows_df_new.attrs.get("fetched_at", time.time())
+        # Atualiza relógio imediatamente após terminar
+        update_caption()
+        progress_ph.empty()
+        render_table(rows_df_new, regional_sel, subtitle_ph, metrics_ph, table_ph)
+
+refresh_block()
+
+
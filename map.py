@@ -1,4 +1,9 @@
-from typing import Dict
+import sys
+import unicodedata
+from functools import lru_cache
+from itertools import chain
+from types import MappingProxyType
+from typing import Dict, Mapping
 # -------------------------------------------------------------------
 # MAPA HARDCODED: "Responsável" -> "Time"
 TEAM_MAP_RAW: Dict[str, str] = {
@@ -14,7 +19,6 @@ TEAM_MAP_RAW: Dict[str, str] = {
     "Beatriz": "CUSTOMER SUCCESS - STIVAL",
     "Thiago Valcácio de Assis": "CS DUVIDAS - THIAGO",
     "João Pradella": "VENDAS - PRADELLA",
-    "Time de Acidentes": "FLEET ACIDENTES - YASMIN",
     "Felipe Ryu Nakamura": "FLEET DOCUMENTACOES - NAKA",
     "Time Alerta": "FLEET DOCUMENTACOES - NAKA",
     "Time de Ocorrências": "FLEET DOCUMENTACOES - NAKA",
@@ -89,13 +93,11 @@ filiais = {
     "Mottu Volta Redonda": 396, "Mottu Várzea Grande": 473, "Mottu Foz do Iguaçu": 511, "Mottu Passo Fundo": 522, "Mottu Sinop": 526,
     "Mottu Itumbiara": 537, "Mottu Lages": 527, "Mottu Patos de Minas": 509,
     "Mottu Cachoeiro de Itapemirim": 505, "Mottu Cariacica": 489, "Mottu Nossa Senhora do Socorro": 507,
-    "Mottu Anápolis": 58, "Mottu MX Edomex Coacalco": 499,
+    "Mottu MX Edomex Coacalco": 499,
     "Mottu México CDMX Iztapalapa": 87, "Mottu Campo Grande - RJ": 497,
     "Mottu São José do Ribamar": 513, "Mottu São Mateus": 514, "Mottu Ourinhos": 475, "Mottu Nova Iguaçu": 478, "Mottu Madureira": 476,
     "Mottu Poços de Caldas": 515, "Mottu Americana": 533,
-    "Mottu Marília": 536, "Mottu Botucatu": 523, "Mottu Votuporanga": 542, "Mottu Varginha": 546, "Mottu Chapecó": 544,
-    "Mottu Caxias": 366, "Mottu Ji Paraná": 416, "Mottu Itapetininga": 449,
-    "Mottu Campos dos Goytacazes": 285, "Mottu Ponta Grossa": 319, "Mottu Cascavel": 397
+    "Mottu Marília": 536, "Mottu Botucatu": 523, "Mottu Votuporanga": 542, "Mottu Varginha": 546, "Mottu Chapecó": 544
 }
 
 regionais_base = {
@@ -107,3 +109,51 @@ regionais_base = {
     "Lucas": [42, 48, 107, 249, 113, 47, 43, 106, 71, 499, 459, 87, 413, 85, 11],
     "Rogério": [69, 70, 73, 76, 110, 115, 271, 274, 258, 329, 51, 95, 284, 252, 238, 80, 109, 49, 50, 310, 295, 405, 384, 225, 248, 266, 283, 250, 365, 282, 64, 175, 311, 469, 417, 356, 458]
 }
+
+# -------------------------------------------------------------------
+# Derivados dos literais acima. Ficam aqui (e não no app.py) de propósito:
+# o Streamlit re-executa o script principal a cada rerun, mas módulos
+# importados são avaliados uma única vez por processo.
+
+@lru_cache(maxsize=4096)
+def _normalize(s: str) -> str:
+    if s is None:
+        return ""
+    s = str(s).strip()
+    # ASCII puro não tem o que decompor — evita o NFKD + filtro de combinantes
+    if s.isascii():
+        return s.casefold()
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return s.casefold()
+
+# Os lookups derivados são congelados com MappingProxyType: mutação acidental
+# em runtime invalidaria as tabelas pré-computadas sem ninguém perceber.
+
+# Chaves normalizadas e valores já limpos: o consumo vira lookup/map direto.
+# sys.intern nas strings deixa o hit do dict cair no fast-path de identidade.
+TEAM_MAP: Mapping[str, str] = MappingProxyType({
+    sys.intern(_normalize(k)): sys.intern(str(v).strip())
+    for k, v in TEAM_MAP_RAW.items()
+    if str(k).strip() and str(v).strip()
+})
+
+# mapa inverso código -> regional
+code_to_regional: Mapping[int, str] = MappingProxyType(
+    {c: reg for reg, codes in regionais_base.items() for c in codes}
+)
+
+# Lookups de filial tolerantes a caixa/acentos/espaços ("Lugar" vem livre do
+# Intercom). O mapa combinado nome -> regional evita o salto nome -> código ->
+# regional por contato.
+FILIAL_CODE_NORM: Mapping[str, int] = MappingProxyType({_normalize(n): c for n, c in filiais.items()})
+FILIAL_TO_REGIONAL: Mapping[str, str] = MappingProxyType({
+    norm: code_to_regional.get(code, "NÃO MAPEADO") for norm, code in FILIAL_CODE_NORM.items()
+})
+
+_regionais_ui = dict(regionais_base)
+_regionais_ui["Luciano"] = sorted(chain.from_iterable(regionais_base.values()))
+regionais_ui: Mapping[str, list] = MappingProxyType(_regionais_ui)
+
+# Opções do filtro de regional (constantes — calculadas uma vez por processo)
+REGIONAIS_DISPONIVEIS = ("Todos", *sorted(regionais_ui), "NÃO MAPEADO")